@@ -5,9 +5,11 @@
 import streamlit as st
 import pandas as pd
 import numpy as np
-import plotly.express as px
+import plotly.graph_objects as go
 import pycountry
 import pathlib
+import functools
+import hashlib
 
 # ------------------------------
 # ✅ Streamlit 기본 설정
@@ -18,53 +20,110 @@ st.title("🌐 리튬 및 코발트 국제 교역 지도 (primaryvalue 기반)")
 # ------------------------------
 # ✅ 1. 데이터 불러오기
 # ------------------------------
+PARQUET_PATH = "dataset_filtered_80.parquet"
+MD5_PATH = ".dataset.md5"
+CATEGORY_COLS = ['period', 'cmdcode', 'reporterdesc', 'partnerdesc', 'year']
+INDEX_COLS = ['reporterdesc', 'cmdcode', 'period']
+
+# 원본 CSV → 정제된 Parquet: 문자열 정제·ISO3 변환은 이 경로에서 한 번만 수행
+def _clean_csv_to_parquet(output):
+    # 사용하는 열만 pyarrow 엔진(멀티스레드)으로 읽고, 문자열 열은 타입 추론 생략
+    data = pd.read_csv(
+        output,
+        encoding="utf-8-sig",
+        engine="pyarrow",
+        usecols=['period', 'cmdcode', 'reporterdesc', 'partnerdesc', 'primaryvalue'],
+        dtype={'cmdcode': 'string', 'reporterdesc': 'string', 'partnerdesc': 'string'}
+    )
+
+    for col in ['cmdcode', 'reporterdesc', 'partnerdesc']:
+        data[col] = data[col].str.strip()
+
+    # 문자열 정제는 CSV에서 문자열로 읽힌 경우에만 수행
+    period = data['period']
+    if not pd.api.types.is_numeric_dtype(period):
+        period = period.str.replace('-', '', regex=False).str.strip()
+    data['period'] = period.astype(str)
+    # YYYYMM 정수 나눗셈으로 연도 산출 (문자열 슬라이싱 대신)
+    # 범주 값은 문자열로 바꿔 Parquet에 사전(dictionary) 열로 저장되도록 함
+    year = (pd.to_numeric(period, errors='coerce') // 100).astype('Int16').astype('category')
+    data['year'] = year.cat.rename_categories(str)
+
+    value = data['primaryvalue']
+    if not pd.api.types.is_numeric_dtype(value):
+        value = value.str.replace(',', '', regex=False)
+    data['primaryvalue'] = pd.to_numeric(value, errors='coerce').astype('float32')
+
+    # 반복되는 문자열 열은 category로 변환 (필터 비교는 정수 코드 비교, Parquet은 사전 인코딩)
+    for col in CATEGORY_COLS:
+        data[col] = data[col].astype('category')
+
+    # ISO3 변환은 고유 국가명 단위로 한 번만 수행해 Parquet에 함께 저장
+    name_to_iso = {
+        n: country_fix[n] if n in country_fix else country_to_iso3(n)
+        for n in data['partnerdesc'].cat.categories
+    }
+    data['partner_iso3'] = data['partnerdesc'].map(name_to_iso).astype('category')
+
+    data.to_parquet(PARQUET_PATH, engine="pyarrow", compression="snappy")
+
+    return data
+
+def _read_cached_parquet():
+    return pd.read_parquet(PARQUET_PATH, engine="pyarrow")
+
+def _file_md5(path):
+    digest = hashlib.md5()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
 @st.cache_data
 def load_data():
     import gdown
 
     url = "https://drive.google.com/uc?id=1WtkYFRNwlURmXJbLCsd4Ff0-GmtQoSHa"
     output = "dataset_filtered_80.csv"
-    gdown.download(url, output, quiet=False)
+    csv_path = pathlib.Path(output)
+    md5_path = pathlib.Path(MD5_PATH)
+    stored = md5_path.read_text().strip() if md5_path.exists() else None
 
-    data = pd.read_csv(output, encoding="utf-8-sig")
+    # 로컬 CSV가 없을 때만 다운로드
+    if not csv_path.exists():
+        gdown.download(url, output, quiet=False)
 
-    # 열 이름 표준화
-    data.columns = (
-        data.columns
-        .str.strip()
-        .str.lower()
-        .str.replace('\ufeff', '', regex=False)
-    )
+    # 로컬 CSV가 바뀌었으면(git pull 등) md5를 갱신하고 이전 Parquet 캐시는 폐기
+    current = _file_md5(csv_path)
+    if current != stored:
+        md5_path.write_text(current)
+        pathlib.Path(PARQUET_PATH).unlink(missing_ok=True)
 
-    for col in ['period', 'cmdcode', 'reporterdesc', 'partnerdesc']:
-        if col in data.columns:
-            data[col] = data[col].astype(str).str.strip()
-
-    if 'period' in data.columns:
-        data['period'] = (
-            data['period']
-            .astype(str)
-            .str.replace('-', '', regex=True)
-            .str.strip()
-        )
-        data['year'] = data['period'].astype(str).str[:4]
-
-    if 'primaryvalue' in data.columns:
-        data['primaryvalue'] = (
-            data['primaryvalue']
-            .astype(str)
-            .str.replace(',', '', regex=True)
-            .replace('', np.nan)
-            .astype(float)
-        )
+    # 정제된 Parquet 캐시가 있으면 문자열 정제 과정 없이 바로 읽기
+    if pathlib.Path(PARQUET_PATH).exists():
+        data = _read_cached_parquet()
+    else:
+        data = _clean_csv_to_parquet(output)
 
-    return data
+    data = data.dropna(subset=['partner_iso3', 'primaryvalue'])
+    for col in CATEGORY_COLS:
+        data[col] = data[col].cat.remove_unused_categories()
+
+    # (보고국, 품목코드, 기간) 정렬 인덱스: 필터링을 전체 스캔 대신 이진 탐색으로 처리
+    data = data.sort_values(INDEX_COLS).set_index(INDEX_COLS, drop=False)
 
-data = load_data()
+    # 선택 상자 목록: category 값은 이미 정렬되어 있으므로 별도 unique/정렬 불필요
+    options = {
+        col: list(data[col].cat.categories)
+        for col in ['cmdcode', 'reporterdesc', 'period', 'year']
+    }
+
+    return data, options
 
 # ------------------------------
 # ✅ 2. ISO 코드 변환
 # ------------------------------
+@functools.lru_cache(maxsize=None)
 def country_to_iso3(name):
     try:
         return pycountry.countries.lookup(name).alpha_3
@@ -86,12 +145,31 @@ country_fix = {
     'China, Hong Kong SAR': 'HKG'
 }
 
-if 'partnerdesc' in data.columns:
-    data['partner_iso3'] = data['partnerdesc'].apply(
-        lambda x: country_fix[x] if x in country_fix else country_to_iso3(x)
-    )
+data, options = load_data()
+
+def select_rows(frame, key):
+    try:
+        return frame.iloc[frame.index.get_locs(list(key))]
+    except KeyError:
+        return frame.iloc[0:0]
+
+# 상대국별 합계: groupby 대신 partnerdesc 범주 코드 위에서 바로 누적
+def sum_by_partner(frame):
+    partners = frame['partnerdesc'].cat.categories
+    codes = frame['partnerdesc'].cat.codes.to_numpy()
 
-data = data.dropna(subset=['partner_iso3', 'primaryvalue'])
+    sums = np.bincount(codes, weights=frame['primaryvalue'].to_numpy(), minlength=len(partners))
+    present = np.bincount(codes, minlength=len(partners)) > 0
+
+    # 상대국별 아무 행 하나의 위치 (같은 상대국은 ISO3 코드가 같음)
+    any_row = np.zeros(len(partners), dtype=np.intp)
+    any_row[codes] = np.arange(len(codes))
+
+    return pd.DataFrame({
+        'partnerdesc': partners[present],
+        'partner_iso3': frame['partner_iso3'].to_numpy()[any_row[present]],
+        'primaryvalue': sums[present],
+    })
 
 # ------------------------------
 # ✅ 3. Streamlit UI
@@ -100,33 +178,38 @@ col1, col2, col3, col4 = st.columns(4)
 with col1:
     view_mode = st.radio("보기 단위 선택", ["월별", "연도별"])
 with col2:
-    cmdcode = st.selectbox("📦 품목코드(HS Code)", sorted(data['cmdcode'].unique()))
+    cmdcode = st.selectbox("📦 품목코드(HS Code)", options['cmdcode'])
 with col3:
-    reporter = st.selectbox("📊 보고국(Reporter)", sorted(data['reporterdesc'].unique()))
+    reporter = st.selectbox("📊 보고국(Reporter)", options['reporterdesc'])
 with col4:
-    period = st.selectbox("📅 기간(YYYYMM)", sorted(data['period'].unique()))
+    period = st.selectbox("📅 기간(YYYYMM)", options['period'])
 
+year = None
 if view_mode == "연도별":
-    year = st.selectbox("📆 연도(YYYY)", sorted(data['year'].unique()))
+    year = st.selectbox("📆 연도(YYYY)", options['year'])
 
 # ------------------------------
 # ✅ 4. 데이터 필터링
 # ------------------------------
-if view_mode == "월별":
-    subset = data[
-        (data['period'] == str(period)) &
-        (data['cmdcode'] == str(cmdcode)) &
-        (data['reporterdesc'] == reporter)
-    ].copy()
-    title_text = f"{reporter}의 {cmdcode} 수입 (기간: {period}) [primaryvalue]"
-else:
-    subset = data[
-        (data['year'] == str(year)) &
-        (data['cmdcode'] == str(cmdcode)) &
-        (data['reporterdesc'] == reporter)
-    ].copy()
-    subset = subset.groupby(['partnerdesc', 'partner_iso3'], as_index=False)['primaryvalue'].sum()
-    title_text = f"{reporter}의 {cmdcode} 수입 (연도: {year}) [primaryvalue]"
+# 위젯 조합별 결과 캐시: 이전에 선택했던 조합은 다시 계산하지 않음
+# (_data는 load_data()의 캐시된 결과이므로 해시 대상에서 제외)
+@st.cache_data(max_entries=64)
+def compute_subset(_data, view_mode, cmdcode, reporter, period, year):
+    if view_mode == "월별":
+        subset = select_rows(_data, (reporter, cmdcode, period))
+        title_text = f"{reporter}의 {cmdcode} 수입 (기간: {period}) [primaryvalue]"
+    else:
+        subset = select_rows(_data, (reporter, cmdcode))
+        subset = subset[subset['year'] == year]
+        subset = sum_by_partner(subset)
+        title_text = f"{reporter}의 {cmdcode} 수입 (연도: {year}) [primaryvalue]"
+    return subset, title_text
+
+subset, title_text = compute_subset(
+    data, view_mode, cmdcode, reporter,
+    period if view_mode == "월별" else None,  # 연도별에서는 기간이 결과에 영향 없음
+    year
+)
 
 # ------------------------------
 # ✅ 4. HS 코드 설명
@@ -154,19 +237,18 @@ else:
 if subset.empty:
     st.warning("⚠️ 선택한 조건에 해당하는 데이터가 없습니다. (기간/품목코드/국가 확인)")
 else:
-    fig = px.choropleth(
-        subset,
-        locations="partner_iso3",
-        color="primaryvalue",  # ✅ 로그 대신 원래 값 사용
-        hover_name="partnerdesc",
-        color_continuous_scale="Viridis_r",
-        title=title_text,
-        projection="natural earth"
-    )
+    fig = go.Figure(go.Choropleth(
+        locations=subset['partner_iso3'].to_numpy(),
+        z=subset['primaryvalue'].to_numpy(),  # ✅ 로그 대신 원래 값 사용
+        hovertext=subset['partnerdesc'].to_numpy(),
+        colorscale="Viridis_r",
+        colorbar=dict(title="primaryvalue"),  # ✅ 색상 범례 수정
+        hovertemplate="<b>%{hovertext}</b><br><br>partner_iso3=%{location}<br>primaryvalue=%{z}<extra></extra>"
+    ))
 
     fig.update_layout(
-        geo=dict(showframe=False, showcoastlines=True),
-        coloraxis_colorbar=dict(title="primaryvalue")  # ✅ 색상 범례 수정
+        title_text=title_text,
+        geo=dict(projection_type="natural earth", showframe=False, showcoastlines=True)
     )
 
     st.plotly_chart(fig, use_container_width=True)
@@ -180,8 +262,11 @@ if view_mode == "월별":
 else:
     display_cols = ['cmdcode', 'reporterdesc', 'partnerdesc', 'primaryvalue']
 
-subset_display = subset.reindex(columns=[c for c in display_cols if c in subset.columns])
-st.dataframe(subset_display, hide_index=True, use_container_width=True)
+st.dataframe(
+    subset[[c for c in display_cols if c in subset.columns]],
+    hide_index=True,
+    use_container_width=True
+)
 
 # ------------------------------
 # ✅ 7. 부가 정보